@@ -7,13 +7,16 @@ Kør med: streamlit run app.py
 
 import streamlit as st
 import pandas as pd
-import re
 from pathlib import Path
 from io import BytesIO
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+import os
+import threading
 import zipfile
 from datetime import date
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from rutelister import process_rtf_file, create_excel
 
 st.set_page_config(
     page_title="Rutelister Konverter",
@@ -147,311 +150,72 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-# ============= RTF PARSING FUNKTIONER =============
-
-HEADER_FOOTER_PAT = re.compile(
-    r'(Hasselager FVT|TUR START|TRIP|PAUSE|LÆSSEPORT|HOSTRUTE|VOGNNUMMER|ÅBNE - LUKKE|'
-    r'STARTTID|HJEMKOMSTTID|SLUTTID|ROUTEDATE|Udskrevet:|Side\s+\d+\s+af\s+\d+)', re.IGNORECASE
-)
-
-
-def rtf_to_text(rtf: str) -> str:
-    """Konverter RTF til plain text"""
-    def uni_sub(m):
-        codepoint = int(m.group(1))
-        if codepoint < 0:
-            codepoint = 65536 + codepoint
-        try:
-            ch = chr(codepoint)
-        except ValueError:
-            ch = ' '
-        return ch
-    text = re.sub(r'\\u(-?\d+)\??', uni_sub, rtf)
-
-    def hex_sub(m):
-        try:
-            return bytes.fromhex(m.group(1)).decode('latin-1', errors='ignore')
-        except Exception:
-            return ''
-    text = re.sub(r"\\'([0-9a-fA-F]{2})", hex_sub, text)
-
-    text = re.sub(r'\\par[d]?', '\n', text)
-    text = re.sub(r'\\line', '\n', text)
-    text = re.sub(r'\\cell', '\n', text)
-    text = re.sub(r'\\row', '\n', text)
-    text = re.sub(r'\\tab', '    ', text)
-    text = re.sub(r'\\[a-zA-Z]+\d* ?', ' ', text)
-    text = text.replace('{', ' ').replace('}', ' ')
-    text = re.sub(r'[ \t]+', ' ', text)
-    text = re.sub(r'\n[ \t]+', '\n', text)
-    text = re.sub(r'[ \t]+\n', '\n', text)
-    text = re.sub(r'\n{2,}', '\n', text)
-    return text
-
-
-def split_pages(lines):
-    """Split linjer i sider baseret på sidefod"""
-    pages = []
-    current = []
-    for ln in lines:
-        current.append(ln)
-        if re.search(r"Side\s+\d+\s+af\s+\d+", ln):
-            pages.append(current)
-            current = []
-    if current:
-        pages.append(current)
-    return pages
-
-
-def find_meta(page_lines):
-    """Find metadata fra side"""
-    host_re = re.compile(r'HOSTRUTE:\s*(\d+)')
-    port_re = re.compile(r'LÆSSEPORT:\s*(\d+)')
-    start_re = re.compile(r'STARTTID:\s*([0-2]?\d:\d{2})')
-    slut_re = re.compile(r'SLUTTID:\s*([0-2]?\d:\d{2})')
-    afr_re = re.compile(r'AFREGNINGSTID:\s*(\d+)')
-
-    rutenummer = portnummer = starttid = sluttid = afregningstid = None
-    for ln in page_lines:
-        m = host_re.search(ln)
-        rutenummer = m.group(1) if m else rutenummer
-        m = port_re.search(ln)
-        portnummer = m.group(1) if m else portnummer
-        m = start_re.search(ln)
-        starttid = m.group(1) if m else starttid
-        m = slut_re.search(ln)
-        sluttid = m.group(1) if m else sluttid
-        m = afr_re.search(ln)
-        afregningstid = m.group(1) if m else afregningstid
-    return rutenummer, portnummer, starttid, sluttid, afregningstid
-
-
-def find_street_and_post(page_lines, start_idx, lookahead_depth=12):
-    """Find adresse og postnummer"""
-    street = None
-    postnr = None
-    by = None
-
-    n = len(page_lines)
-    lookahead = []
-    for k in range(1, lookahead_depth + 1):
-        if start_idx + k < n:
-            lookahead.append(page_lines[start_idx + k])
-
-    for s in lookahead:
-        if not s or HEADER_FOOTER_PAT.search(s):
-            continue
-        if re.search(r'\b\d{4}\b', s):
-            continue
-        street = s.strip()
-        break
-
-    for s in lookahead:
-        pm = re.search(r'(\d{4})\s+(.+)$', s)
-        if pm:
-            postnr = pm.group(1)
-            by = pm.group(2).strip()
-            break
-
-    if street is None:
-        for s in lookahead:
-            pm2 = re.search(r'(.+?)\s+(\d{4})\s+(.+)$', s)
-            if pm2 and not HEADER_FOOTER_PAT.search(s):
-                street = pm2.group(1).strip()
-                postnr = pm2.group(2)
-                by = pm2.group(3).strip()
-                break
-
-    return street, postnr, by
-
-
-def parse_page(page_lines):
-    """Parse en enkelt side og udtræk rækker"""
-    stop_line_re = re.compile(
-        r'^(?P<id>\d{5})\s+(?P<name>.+?)\s+'
-        r'(?:\d{1,2}:\d{2})\s*-\s*(?:\d{1,2}:\d{2})'
-        r'(?:\s+\d+){1,8}\s+'
-        r'(?P<ank>\d{1,2}:\d{2})\s+(?P<afg>\d{1,2}:\d{2})\b'
-    )
-
-    rutenummer, portnummer, starttid, sluttid, afregningstid = find_meta(page_lines)
-
-    rows = []
-    for i, ln in enumerate(page_lines):
-        sm = stop_line_re.match(ln)
-        if not sm:
-            continue
-
-        name_raw = sm.group('name').strip()
-        ank = sm.group('ank')
-        afg = sm.group('afg')
-
-        street, postnr, by = find_street_and_post(page_lines, i, lookahead_depth=12)
-
-        if any(x and 'Hasselager' in x for x in [name_raw, street, by]):
-            continue
-
-        butik = re.sub(r'\s+[A]\s*\d*$', '', name_raw).strip()
-
-        afr_hours = None
-        if afregningstid:
-            try:
-                afr_hours = round(float(afregningstid) / 60.0, 2)
-            except:
-                afr_hours = None
-
-        rows.append({
-            "Butiksnavn": butik,
-            "Adresse": street,
-            "Postnr": postnr,
-            "By": by,
-            "Ankomst": ank,
-            "Afgang": afg,
-            "Rutenummer": rutenummer,
-            "Portnummer": portnummer,
-            "Starttid": starttid,
-            "Sluttid": sluttid,
-            "Afregningstid (timer)": afr_hours
-        })
-    return rows
-
-
-def process_rtf_file(file_content: bytes, filename: str) -> tuple:
-    """Behandl en RTF fil og returner DataFrame + statistik"""
-    raw = file_content.decode("latin-1", errors="ignore")
-    text = rtf_to_text(raw)
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    pages = split_pages(lines)
-
-    all_rows = []
-    for page in pages:
-        all_rows.extend(parse_page(page))
-
-    df = pd.DataFrame(all_rows)
-    return df, len(all_rows)
-
-
-def create_excel(df: pd.DataFrame, koerselsdato: str = None) -> BytesIO:
-    """Opret farvekodede Excel fil med fed skrift på første række af hvert rutenummer"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Ruter"
-
-    # Tilføj kørselsdato kolonne hvis angivet
-    if koerselsdato and 'Kørselsdato' not in df.columns:
-        df = df.copy()
-        df['Kørselsdato'] = koerselsdato
-
-    # Rutenummer først, derefter resten - nu med Kørselsdato
-    cols = ["Kørselsdato", "Rutenummer", "Portnummer", "Butiksnavn", "Adresse", "Postnr", "By",
-            "Ankomst", "Afgang", "Starttid", "Sluttid", "Afregningstid (timer)"]
-    ws.append(cols)
-
-    # Header style
-    for c in range(1, len(cols) + 1):
-        cell = ws.cell(row=1, column=c)
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal="center")
-
-    # Append data og find første/sidste række for hvert rutenummer
-    route_rows = {}  # rutenummer -> [første_row, sidste_row]
-    prev_rutenummer = None
-
-    if not df.empty:
-        for idx, row in df[cols].iterrows():
-            ws.append(row.tolist())
-            current_row = ws.max_row
-            current_rutenummer = row["Rutenummer"]
-
-            # Track første og sidste række per rute
-            if current_rutenummer != prev_rutenummer:
-                # Afslut forrige rute
-                if prev_rutenummer is not None and prev_rutenummer in route_rows:
-                    route_rows[prev_rutenummer][1] = current_row - 1
-                # Start ny rute
-                route_rows[current_rutenummer] = [current_row, current_row]
-                prev_rutenummer = current_rutenummer
-            else:
-                # Opdater sidste række for nuværende rute
-                if current_rutenummer in route_rows:
-                    route_rows[current_rutenummer][1] = current_row
-
-    # Farver
-    YELLOW = "FFF9C4"
-    BLUE = "BBDEFB"
-    GREEN = "C8E6C9"
-    PURPLE = "E1BEE7"
-    GREY = "ECEFF1"
-    ORANGE = "FFE0B2"  # Kørselsdato farve
-
-    fill_map = {
-        "Kørselsdato": ORANGE,
-        "Butiksnavn": YELLOW, "Adresse": YELLOW, "Postnr": YELLOW, "By": YELLOW,
-        "Ankomst": BLUE, "Afgang": BLUE,
-        "Rutenummer": GREEN,
-        "Portnummer": PURPLE,
-        "Starttid": GREY, "Sluttid": GREY, "Afregningstid (timer)": GREY
-    }
-    col_idx = {name: idx + 1 for idx, name in enumerate(cols)}
-    max_row = ws.max_row
-
-    for name, color in fill_map.items():
-        idx = col_idx[name]
-        fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
-        for r in range(1, max_row + 1):
-            ws.cell(row=r, column=idx).fill = fill
-
-    # Definer kant-styles
-    thick_border = Side(style='medium', color='000000')
-    thin_border = Side(style='thin', color='AAAAAA')
-
-    # Anvend fed skrift på første række + kanter omkring hver rute-gruppe
-    for rutenummer, (first_row, last_row) in route_rows.items():
-        # Fed skrift på første række
-        for c in range(1, len(cols) + 1):
-            cell = ws.cell(row=first_row, column=c)
-            cell.font = Font(bold=True)
-
-        # Kant omkring hele rute-gruppen
-        for r in range(first_row, last_row + 1):
-            for c in range(1, len(cols) + 1):
-                cell = ws.cell(row=r, column=c)
-
-                # Bestem kanterne for denne celle
-                top = thick_border if r == first_row else thin_border
-                bottom = thick_border if r == last_row else thin_border
-                left = thick_border if c == 1 else thin_border
-                right = thick_border if c == len(cols) else thin_border
-
-                cell.border = Border(top=top, bottom=bottom, left=left, right=right)
-
-    # Freeze header og autosize
-    ws.freeze_panes = "A2"
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            val = "" if cell.value is None else str(cell.value)
-            if len(val) > max_length:
-                max_length = len(val)
-        ws.column_dimensions[column].width = min(60, max(12, max_length + 2))
-
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
-
+# ============= DOWNLOAD OG CACHE =============
 
 def create_zip_with_all_files(files_data: list) -> BytesIO:
     """Opret ZIP fil med alle Excel filer"""
     zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+    # XLSX er allerede en komprimeret ZIP - gem filerne ukomprimeret i stedet for at deflate dem igen
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zf:
         for filename, excel_data in files_data:
-            zf.writestr(filename, excel_data.getvalue())
+            zf.writestr(filename, excel_data)
     zip_buffer.seek(0)
     return zip_buffer
 
 
+@st.cache_resource
+def _get_executor() -> ProcessPoolExecutor:
+    """Procespulje til parsing og Excel-generering - deles på tværs af reruns, så workers genbruges"""
+    return ProcessPoolExecutor(max_workers=os.cpu_count())
+
+
+@st.cache_resource
+def _get_executor_lock() -> threading.Lock:
+    """Lås om udskiftning af procespuljen - caches, så alle reruns og sessioner deler samme lås"""
+    return threading.Lock()
+
+
+def _run_in_pool(fn, *args):
+    """Kør fn i procespuljen - er den ødelagt (fx en worker dræbt af OOM), bygges en ny og prøves igen"""
+    executor = _get_executor()
+    try:
+        return executor.submit(fn, *args).result()
+    except BrokenProcessPool:
+        # Kun den første tråd erstatter den ødelagte pulje - de øvrige genbruger den nye
+        with _get_executor_lock():
+            if _get_executor() is executor:
+                _get_executor.clear()
+                executor.shutdown(wait=False)
+            executor = _get_executor()
+        return executor.submit(fn, *args).result()
+
+
+def _hash_dataframe(df: pd.DataFrame) -> bytes:
+    """Præcis cache-nøgle for en DataFrame - Streamlit hasher kun et udsnit af rækkerne i store frames"""
+    return str(list(df.columns)).encode() + pd.util.hash_pandas_object(df, index=True).values.tobytes()
+
+
+# Cachen deles af alle sessioner - begræns den, så nye rutelister hver dag ikke fylder serverens hukommelse op
+@st.cache_data(show_spinner=False, max_entries=32, ttl="1h")
+def _parse_cached(content: bytes, filename: str) -> tuple:
+    """Parset RTF fil - caches på filens indhold, så en ny kørselsdato ikke giver ny parsing"""
+    return _run_in_pool(process_rtf_file, content, filename)
+
+
+@st.cache_data(show_spinner=False, max_entries=32, ttl="1h", hash_funcs={pd.DataFrame: _hash_dataframe})
+def _create_excel_cached(df: pd.DataFrame, koerselsdato: str) -> bytes:
+    """Excel fil som bytes - caches på indhold, så Streamlit-reruns ikke genererer den igen"""
+    return _run_in_pool(create_excel, df, koerselsdato).getvalue()
+
+
+def _process_one(content: bytes, filename: str, koerselsdato: str) -> tuple:
+    """Behandl én uploadet fil - cache-hits returnerer straks, resten udføres i procespuljen"""
+    df, row_count = _parse_cached(content, filename)
+    excel_data = _create_excel_cached(df, koerselsdato)
+    output_name = Path(filename).stem + "_farvestruktur.xlsx"
+    return filename, output_name, df, row_count, excel_data
+
+
 # ============= STREAMLIT UI =============
 
 def main():
@@ -522,31 +286,43 @@ def main():
         progress_bar = st.progress(0)
         status_text = st.empty()
 
-        all_results = []
+        all_results = [None] * len(uploaded_files)
         total_rows = 0
 
-        for i, uploaded_file in enumerate(uploaded_files):
-            status_text.text(f"Behandler: {uploaded_file.name}")
-            progress_bar.progress((i + 1) / len(uploaded_files))
-
-            try:
-                content = uploaded_file.read()
-                df, row_count = process_rtf_file(content, uploaded_file.name)
-
-                excel_data = create_excel(df, koerselsdato_str)
-                output_name = Path(uploaded_file.name).stem + "_farvestruktur.xlsx"
-
-                all_results.append({
-                    'filename': uploaded_file.name,
+        # Filerne er uafhængige - trådene venter på cachen eller procespuljen, som alligevel
+        # kun har én worker per CPU, så der bruges ikke flere tråde end det
+        status_text.text(f"Behandler {len(uploaded_files)} fil(er)...")
+        workers = min(len(uploaded_files), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    _process_one, uploaded_file.getvalue(), uploaded_file.name, koerselsdato_str
+                ): i
+                for i, uploaded_file in enumerate(uploaded_files)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                name = uploaded_files[i].name
+                status_text.text(f"Behandlet: {name}")
+                progress_bar.progress(done / len(uploaded_files))
+
+                try:
+                    filename, output_name, df, row_count, excel_data = future.result()
+                except Exception as e:
+                    st.error(f"Fejl ved behandling af {name}: {str(e)}")
+                    continue
+
+                all_results[i] = {
+                    'filename': filename,
                     'output_name': output_name,
                     'df': df,
                     'row_count': row_count,
                     'excel_data': excel_data
-                })
+                }
                 total_rows += row_count
 
-            except Exception as e:
-                st.error(f"Fejl ved behandling af {uploaded_file.name}: {str(e)}")
+        # Bevar upload-rækkefølgen og spring fejlede filer over
+        all_results = [r for r in all_results if r is not None]
 
         status_text.text("Færdig!")
         progress_bar.progress(1.0)
@@ -602,8 +378,6 @@ def main():
                             st.warning("Ingen data fundet i filen")
 
                     with col2:
-                        # Reset BytesIO position
-                        result['excel_data'].seek(0)
                         st.download_button(
                             label="⬇️ Download",
                             data=result['excel_data'],
@@ -626,11 +400,10 @@ def main():
                     height=400
                 )
 
-                # Download samlet fil
-                combined_excel = create_excel(combined_df, koerselsdato_str)
+                # Download samlet fil - genereres først ved klik, og caches på tværs af reruns
                 st.download_button(
                     label="📥 Download samlet Excel-fil",
-                    data=combined_excel,
+                    data=lambda: _create_excel_cached(combined_df, koerselsdato_str),
                     file_name="rutelister_samlet.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     use_container_width=True
@@ -0,0 +1,355 @@
+"""
+Rutelister RTF → Excel - parsing og Excel-generering
+=====================================================
+Ligger i et selvstændigt modul, så procespuljens workers kan importere funktionerne
+i stedet for at slå dem op i Streamlits skiftende __main__-modul.
+"""
+
+import re
+from io import BytesIO
+from itertools import product
+
+import pandas as pd
+import xlsxwriter
+
+
+# ============= RTF PARSING FUNKTIONER =============
+
+# Linjer der hører til sidehoved/-fod - tjekkes som store bogstaver med substring-test
+_HEADER_FOOTER_TOKENS = (
+    "HASSELAGER FVT", "TUR START", "TRIP", "PAUSE", "LÆSSEPORT", "HOSTRUTE", "VOGNNUMMER", "ÅBNE - LUKKE",
+    "STARTTID", "HJEMKOMSTTID", "SLUTTID", "ROUTEDATE", "UDSKREVET:",
+)
+_HEADER_FOOTER_SIDE_RE = re.compile(r'Side\s+\d+\s+af\s+\d+', re.IGNORECASE)
+
+# RTF → tekst: ét gennemløb over alle kontrolord og klammer
+_RTF_TOKEN_RE = re.compile(
+    r"\\(?:u(?P<uni>-?\d+)\??"
+    r"|'(?P<hex>[0-9a-fA-F]{2})"
+    r"|(?P<nl>par[d]?|line|cell|row)"
+    r"|(?P<tab>tab)"
+    r"|[a-zA-Z]+\d* ?)"
+    r"|[{}]"
+)
+# Whitespace: blanke omkring linjeskift og tomme linjer → ét linjeskift, øvrige blanke → ét mellemrum
+_NEWLINE_RUN_RE = re.compile(r'[ \t]*\n[ \t\n]*')
+_BLANK_RUN_RE = re.compile(r'\t[ \t]*| [ \t]+')
+
+# Sidefod
+_PAGE_FOOT_RE = re.compile(r"Side\s+\d+\s+af\s+\d+")
+
+# Metadata - ét mønster med en navngivet gruppe per felt
+_META_RE = re.compile(
+    r'HOSTRUTE:\s*(?P<host>\d+)'
+    r'|LÆSSEPORT:\s*(?P<port>\d+)'
+    r'|STARTTID:\s*(?P<start>[0-2]?\d:\d{2})'
+    r'|SLUTTID:\s*(?P<slut>[0-2]?\d:\d{2})'
+    r'|AFREGNINGSTID:\s*(?P<afr>\d+)'
+)
+
+# Adresse og postnummer
+_4DIGIT_RE = re.compile(r'\b\d{4}\b')
+_POSTNR_RE = re.compile(r'(\d{4})\s+(.+)$')
+_STREET_POST_RE = re.compile(r'(.+?)\s+(\d{4})\s+(.+)$')
+
+# Stop-linjer
+_STOP_LINE_RE = re.compile(
+    r'^(?P<id>\d{5})\s+(?P<name>.+?)\s+'
+    r'(?:\d{1,2}:\d{2})\s*-\s*(?:\d{1,2}:\d{2})'
+    r'(?:\s+\d+){1,8}\s+'
+    r'(?P<ank>\d{1,2}:\d{2})\s+(?P<afg>\d{1,2}:\d{2})\b'
+)
+_BUTIK_SUFFIX_RE = re.compile(r'\s+[A]\s*\d*$')
+
+# Kolonner i den rækkefølge parse_page returnerer dem
+ROW_COLUMNS = ("Butiksnavn", "Adresse", "Postnr", "By", "Ankomst", "Afgang",
+               "Rutenummer", "Portnummer", "Starttid", "Sluttid", "Afregningstid (timer)")
+
+
+def rtf_to_text(rtf: str) -> str:
+    """Konverter RTF til plain text"""
+    def token_sub(m):
+        kind = m.lastgroup
+        if kind == 'uni':
+            codepoint = int(m.group('uni'))
+            if codepoint < 0:
+                codepoint = 65536 + codepoint
+            try:
+                return chr(codepoint)
+            except ValueError:
+                return ' '
+        if kind == 'hex':
+            return bytes.fromhex(m.group('hex')).decode('latin-1')
+        if kind == 'nl':
+            return '\n'
+        if kind == 'tab':
+            return '    '
+        # Øvrige kontrolord og klammer
+        return ' '
+    text = _RTF_TOKEN_RE.sub(token_sub, rtf)
+    text = _NEWLINE_RUN_RE.sub('\n', text)
+    return _BLANK_RUN_RE.sub(' ', text)
+
+
+def split_pages(lines):
+    """Split linjer i sider baseret på sidefod"""
+    pages = []
+    current = []
+    for ln in lines:
+        current.append(ln)
+        # Billig substring-test først - kun sidefoden indeholder "Side"
+        if "Side" in ln and _PAGE_FOOT_RE.search(ln):
+            pages.append(current)
+            current = []
+    if current:
+        pages.append(current)
+    return pages
+
+
+def find_meta(page_lines):
+    """Find metadata fra side"""
+    # Sidste forekomst på siden vinder - gennemløb baglæns og stop, når alle felter er fundet
+    meta = {}
+    for ln in reversed(page_lines):
+        if ':' not in ln:
+            continue
+        for m in _META_RE.finditer(ln):
+            meta.setdefault(m.lastgroup, m.group(m.lastgroup))
+        if len(meta) == 5:
+            break
+    return meta.get('host'), meta.get('port'), meta.get('start'), meta.get('slut'), meta.get('afr')
+
+
+def _is_header_footer(s):
+    """Er linjen en del af sidehoved/-fod"""
+    u = s.upper()
+    for token in _HEADER_FOOTER_TOKENS:
+        if token in u:
+            return True
+    return "SIDE" in u and _HEADER_FOOTER_SIDE_RE.search(s) is not None
+
+
+def find_street_and_post(page_lines, start_idx, lookahead_depth=12):
+    """Find adresse og postnummer"""
+    street = None
+    postnr = None
+    by = None
+
+    lookahead = page_lines[start_idx + 1:start_idx + 1 + lookahead_depth]
+
+    for s in lookahead:
+        if not s or _is_header_footer(s):
+            continue
+        if _4DIGIT_RE.search(s):
+            continue
+        street = s.strip()
+        break
+
+    for s in lookahead:
+        pm = _POSTNR_RE.search(s)
+        if pm:
+            postnr = pm.group(1)
+            by = pm.group(2).strip()
+            break
+
+    if street is None:
+        for s in lookahead:
+            pm2 = _STREET_POST_RE.search(s)
+            if pm2 and not _is_header_footer(s):
+                street = pm2.group(1).strip()
+                postnr = pm2.group(2)
+                by = pm2.group(3).strip()
+                break
+
+    return street, postnr, by
+
+
+def parse_page(page_lines):
+    """Parse en enkelt side og udtræk rækker som én liste per kolonne i ROW_COLUMNS"""
+    rutenummer, portnummer, starttid, sluttid, afregningstid = find_meta(page_lines)
+
+    # Afregningstid er den samme for hele siden - omregn til timer én gang
+    afr_hours = None
+    if afregningstid:
+        try:
+            afr_hours = round(float(afregningstid) / 60.0, 2)
+        except:
+            afr_hours = None
+
+    butikker, adresser, postnumre, byer, ankomster, afgange = [], [], [], [], [], []
+    for i, ln in enumerate(page_lines):
+        # Stop-linjer starter altid med 5 cifre - spring regex over for alle andre linjer
+        if not ln[:5].isdigit():
+            continue
+        sm = _STOP_LINE_RE.match(ln)
+        if not sm:
+            continue
+
+        name_raw = sm.group('name').strip()
+        ank = sm.group('ank')
+        afg = sm.group('afg')
+
+        street, postnr, by = find_street_and_post(page_lines, i, lookahead_depth=12)
+
+        butik = _BUTIK_SUFFIX_RE.sub('', name_raw).strip()
+
+        butikker.append(butik)
+        adresser.append(street)
+        postnumre.append(postnr)
+        byer.append(by)
+        ankomster.append(ank)
+        afgange.append(afg)
+
+    # Sidens metadata gentages på hver række
+    n = len(butikker)
+    rutenumre, portnumre = [rutenummer] * n, [portnummer] * n
+    starttider, sluttider, afregninger = [starttid] * n, [sluttid] * n, [afr_hours] * n
+    return (butikker, adresser, postnumre, byer, ankomster, afgange,
+            rutenumre, portnumre, starttider, sluttider, afregninger)
+
+
+def process_rtf_file(file_content: bytes, filename: str) -> tuple:
+    """Behandl en RTF fil og returner DataFrame + statistik"""
+    # latin-1 dækker alle bytes, så dekodningen kan ikke fejle;
+    # den dekodede tekst holdes ikke i live under parsningen
+    text = rtf_to_text(file_content.decode("latin-1"))
+    lines = [ln for ln in map(str.strip, text.splitlines()) if ln]
+    del text
+    pages = split_pages(lines)
+
+    columns = [[] for _ in ROW_COLUMNS]
+    for page in pages:
+        for column, values in zip(columns, parse_page(page)):
+            column.extend(values)
+
+    df = pd.DataFrame(dict(zip(ROW_COLUMNS, columns)))
+
+    # Fjern Hasselager-rækker (lageret selv) vektoriseret på hele filen
+    if not df.empty:
+        mask = (df["Butiksnavn"].str.contains("Hasselager", na=False, regex=False)
+                | df["Adresse"].str.contains("Hasselager", na=False, regex=False)
+                | df["By"].str.contains("Hasselager", na=False, regex=False))
+        df = df[~mask].reset_index(drop=True)
+    return df, len(df)
+
+
+# ============= EXCEL FUNKTIONER =============
+
+BOLD_FONT = {'bold': True}
+HEADER_ALIGNMENT = {'align': 'center'}
+
+# xlsxwriter kant-stil 2 = medium, 1 = thin
+THICK_SIDE = (2, '#000000')
+THIN_SIDE = (1, '#AAAAAA')
+
+
+def _border(edge: str, thick: bool) -> dict:
+    """xlsxwriter-egenskaber for én kant - tyk sort eller tynd grå"""
+    style, color = THICK_SIDE if thick else THIN_SIDE
+    return {edge: style, f'{edge}_color': color}
+
+
+# Kant-egenskaber omkring hver rute-gruppe: (første række, sidste række, første kolonne, sidste kolonne)
+# -> dict med xlsxwriter-formategenskaber, som senere flettes sammen med kolonnens fyldfarve
+ROUTE_BORDERS = {
+    (is_top, is_bottom, is_left, is_right): {
+        **_border('top', is_top), **_border('bottom', is_bottom),
+        **_border('left', is_left), **_border('right', is_right),
+    }
+    for is_top, is_bottom, is_left, is_right in product((True, False), repeat=4)
+}
+
+
+def create_excel(df: pd.DataFrame, koerselsdato: str = None) -> BytesIO:
+    """Opret farvekodede Excel fil med fed skrift på første række af hvert rutenummer"""
+    # constant_memory: hver række skrives ud i rækkefølge og glemmes,
+    # i stedet for at hele arket holdes i hukommelsen.
+    # strings_to_urls slået fra, så fx adresser der ligner URL'er forbliver almindelig tekst
+    output = BytesIO()
+    wb = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_urls': False})
+    ws = wb.add_worksheet("Ruter")
+
+    # Tilføj kørselsdato kolonne hvis angivet
+    if koerselsdato and 'Kørselsdato' not in df.columns:
+        df = df.copy()
+        df['Kørselsdato'] = koerselsdato
+
+    # Rutenummer først, derefter resten - nu med Kørselsdato
+    cols = ["Kørselsdato", "Rutenummer", "Portnummer", "Butiksnavn", "Adresse", "Postnr", "By",
+            "Ankomst", "Afgang", "Starttid", "Sluttid", "Afregningstid (timer)"]
+
+    # Farver (RRGGBB). xlsxwriter skriver dem som uigennemsigtige ARGB ("FF" + RRGGBB)
+    # i styles.xml, så der skal ikke selv sættes alpha-præfiks på
+    YELLOW = "FFF9C4"
+    BLUE = "BBDEFB"
+    GREEN = "C8E6C9"
+    PURPLE = "E1BEE7"
+    GREY = "ECEFF1"
+    ORANGE = "FFE0B2"  # Kørselsdato farve
+
+    fill_map = {
+        "Kørselsdato": ORANGE,
+        "Butiksnavn": YELLOW, "Adresse": YELLOW, "Postnr": YELLOW, "By": YELLOW,
+        "Ankomst": BLUE, "Afgang": BLUE,
+        "Rutenummer": GREEN,
+        "Portnummer": PURPLE,
+        "Starttid": GREY, "Sluttid": GREY, "Afregningstid (timer)": GREY
+    }
+    fills = [{'pattern': 1, 'bg_color': '#' + fill_map[name]} for name in cols]
+
+    # Formater per rækketype (første række i ruten, sidste række i ruten) som én liste med ét format
+    # per kolonne, så løkken over cellerne kun indekserer efter position - oprettes én gang per workbook
+    last_col = len(cols) - 1
+    row_formats = {}
+    for is_first in (True, False):
+        for is_last in (True, False):
+            formats = []
+            for c, fill in enumerate(fills):
+                props = {**fill, **ROUTE_BORDERS[(is_first, is_last, c == 0, c == last_col)]}
+                if is_first:
+                    props.update(BOLD_FONT)
+                formats.append(wb.add_format(props))
+            row_formats[(is_first, is_last)] = formats
+
+    # Autosize fra data per kolonne
+    col_widths = [len(name) for name in cols]
+    if not df.empty:
+        for i, name in enumerate(cols):
+            lengths = df[name].dropna().astype(str).str.len()
+            if not lengths.empty:
+                col_widths[i] = max(col_widths[i], int(lengths.max()))
+    for i, width in enumerate(col_widths):
+        ws.set_column(i, i, min(60, max(12, width + 2)))
+
+    # Freeze header
+    ws.freeze_panes(1, 0)
+
+    # Header style
+    for c, (name, fill) in enumerate(zip(cols, fills)):
+        ws.write_string(0, c, name, wb.add_format({**fill, **BOLD_FONT, **HEADER_ALIGNMENT}))
+
+    # Fed skrift på første række + kanter omkring hver rute-gruppe, sat i samme gennemløb som data.
+    # En række starter en rute-gruppe, når rutenummeret skifter fra rækken før, og slutter den, når det
+    # skifter til rækken efter - beregnet vektoriseret på hele kolonnen.
+    # Manglende tal (NaN) skrives som tomme celler
+    if df.empty:
+        rows = starts = ends = ()
+    else:
+        # Rækker uden rutenummer hører til samme gruppe som hinanden (pandas ville ellers regne None != None)
+        rutenumre = df["Rutenummer"].fillna("")
+        starts = rutenumre.ne(rutenumre.shift()).tolist()
+        ends = rutenumre.ne(rutenumre.shift(-1)).tolist()
+        rows = df[cols].astype(object).where(df[cols].notna(), None).itertuples(index=False, name=None)
+    for r, (row, is_first, is_last) in enumerate(zip(rows, starts, ends), 1):
+        # Skriv direkte med den typede metode - ws.write() afprøver ellers formel-/tal-mønstre på hver tekst
+        for c, (value, fmt) in enumerate(zip(row, row_formats[(is_first, is_last)])):
+            if value is None:
+                ws.write_blank(r, c, None, fmt)
+            elif isinstance(value, str):
+                ws.write_string(r, c, value, fmt)
+            else:
+                ws.write_number(r, c, value, fmt)
+
+    wb.close()
+    output.seek(0)
+    return output